@@ -1,25 +1,44 @@
-from utils.file_handler import read_sales_data
-from utils.data_processor import (
-    parse_transactions,
-    validate_and_filter
-)
-from utils.api_handler import (
-    fetch_all_products,
-    create_product_mapping,
-    enrich_sales_data,
-    save_enriched_data
-)
-from utils.report_generator import generate_sales_report
+from utils.pipeline import API_CACHE_SECONDS, build_sales_pipeline
+
+
+# Seconds to wait for the product API once the sales data is ready
+API_DEADLINE = 15
+
+
+def run_pipeline(filename="data/sales_data.txt", region=None, min_amount=None, max_amount=None,
+                 enriched_file="data/enriched_sales_data.txt", report_file="output/sales_report.txt",
+                 api_url=None, api_deadline=API_DEADLINE, api_cache_seconds=API_CACHE_SECONDS,
+                 use_cache=True):
+    # Non-interactive version of main() for batch runs. Stages whose inputs,
+    # params and code haven't changed since the last run are skipped; the
+    # product catalog is refetched once it is older than api_cache_seconds
+    # (0 to always refetch, None to keep it until the cache is cleared).
+    pipeline = build_sales_pipeline(
+        filename=filename,
+        region=region,
+        min_amount=min_amount,
+        max_amount=max_amount,
+        enriched_file=enriched_file,
+        report_file=report_file,
+        api_url=api_url,
+        api_deadline=api_deadline,
+        api_cache_seconds=api_cache_seconds,
+        use_cache=use_cache
+    )
+
+    # The API fetch (if not cached) runs in the background while the file is parsed
+    pipeline.start_background()
+    pipeline.run()
+    print("Process finished.")
+
+    return pipeline
 
 
 def main():
-    print("Reading sales data...")
-    raw_lines = read_sales_data("data/sales_data.txt")
-    print(f"Loaded {len(raw_lines)} rows")
+    pipeline = build_sales_pipeline(api_deadline=API_DEADLINE)
+    pipeline.start_background()
 
-    print("Parsing transactions...")
-    transactions = parse_transactions(raw_lines)
-    print(f"Parsed {len(transactions)} records")
+    transactions = pipeline.value("parse")
 
     # Show available regions and amount range
     regions = sorted(set(t["Region"] for t in transactions if t.get("Region")))
@@ -48,26 +67,13 @@ def main():
         if max_input:
             filter_max_amount = float(max_input)
 
-    print("Validating transactions...")
-    valid_transactions, invalid_count, _ = validate_and_filter(
-        transactions,
+    pipeline.set_params(
+        "validate",
         region=filter_region,
         min_amount=filter_min_amount,
         max_amount=filter_max_amount
     )
-    print(f"Valid: {len(valid_transactions)}, Invalid: {invalid_count}")
-
-    print("Fetching product data from API...")
-    api_products = fetch_all_products()
-    product_mapping = create_product_mapping(api_products)
-    enriched_transactions = enrich_sales_data(valid_transactions, product_mapping)
-    print(f"Enriched {len(enriched_transactions)} transactions")
-
-    print("Saving enriched data...")
-    save_enriched_data(enriched_transactions, "data/enriched_sales_data.txt")
-
-    print("Generating report...")
-    generate_sales_report(valid_transactions, enriched_transactions, "output/sales_report.txt")
+    pipeline.run()
 
     print("Process finished.")
 
@@ -1,9 +1,15 @@
-import requests
 import os
+import threading
 
 
-def fetch_all_products():
-    url = "https://dummyjson.com/products?limit=100"
+PRODUCTS_URL = "https://dummyjson.com/products?limit=100"
+
+
+def _fetch_products(url):
+    # Returns (products, status message) without printing anything, so it
+    # can run in a background thread
+    # Imported here so runs that never hit the API don't pay for loading requests
+    import requests
 
     try:
         response = requests.get(url, timeout=10)
@@ -12,17 +18,49 @@ def fetch_all_products():
         data = response.json()
         products = data.get('products', [])
 
-        print("API fetch successful")
-        return products
+        return products, "API fetch successful"
 
     except requests.exceptions.RequestException:
-        print("API fetch failed")
-        return []
+        return [], "API fetch failed"
 
     except Exception:
-        print("API processing failed")
+        return [], "API processing failed"
+
+
+class ProductFetch:
+    # Holds the result of a background fetch. The worker thread only stores
+    # the result; wait_for_products prints the status from the caller's thread.
+
+    def __init__(self, url):
+        self.products = []
+        self.message = "API processing failed"
+        self.done = threading.Event()
+
+        # Daemon thread so a hung request can't keep the program alive
+        threading.Thread(target=self._run, args=(url,), daemon=True).start()
+
+    def _run(self, url):
+        try:
+            self.products, self.message = _fetch_products(url)
+        finally:
+            self.done.set()
+
+
+def start_product_fetch(url=PRODUCTS_URL):
+    # Run the fetch in the background so the network round-trip overlaps
+    # with reading and parsing the sales file
+    return ProductFetch(url)
+
+
+def wait_for_products(fetch, deadline=15):
+    # Join the background fetch; after the deadline carry on without API data
+    if not fetch.done.wait(deadline):
+        print("API fetch timed out")
         return []
 
+    print(fetch.message)
+    return fetch.products
+
 
 def create_product_mapping(api_products):
     # Build a dictionary mapping product IDs to their info
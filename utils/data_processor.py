@@ -1,3 +1,12 @@
+import hashlib
+import heapq
+import json
+import os
+import tempfile
+
+from utils.dedup import TransactionIDDeduper
+
+
 def parse_transactions(raw_lines):
     transactions = []
     expected_fields = 8
@@ -50,7 +59,38 @@ def parse_transactions(raw_lines):
     return transactions
 
 
-def validate_and_filter(transactions, region=None, min_amount=None, max_amount=None):
+def _apply_filters(transactions, region=None, min_amount=None, max_amount=None):
+    filtered_by_region = 0
+    filtered_by_amount = 0
+
+    filtered = transactions
+
+    if region:
+        before = len(filtered)
+        filtered = [t for t in filtered if t['Region'] == region]
+        filtered_by_region = before - len(filtered)
+        print("Records after region filter:", len(filtered))
+
+    if min_amount is not None or max_amount is not None:
+        before = len(filtered)
+        temp = []
+        for t in filtered:
+            amount = t['Quantity'] * t['UnitPrice']
+            if min_amount is not None and amount < min_amount:
+                continue
+            if max_amount is not None and amount > max_amount:
+                continue
+            temp.append(t)
+
+        filtered = temp
+        filtered_by_amount = before - len(filtered)
+        print("Records after amount filter:", len(filtered))
+
+    return filtered, filtered_by_region, filtered_by_amount
+
+
+def validate_and_filter(transactions, region=None, min_amount=None, max_amount=None, deduper=None,
+                        check_duplicates=True):
     required_fields = [
         'TransactionID', 'Date', 'ProductID', 'ProductName',
         'Quantity', 'UnitPrice', 'CustomerID', 'Region'
@@ -59,6 +99,16 @@ def validate_and_filter(transactions, region=None, min_amount=None, max_amount=N
     total_input = len(transactions)
     valid_transactions = []
     invalid_count = 0
+    duplicate_count = 0
+
+    # Pass a shared TransactionIDDeduper to catch repeats across several
+    # calls, or check_duplicates=False to skip the check entirely
+    if not check_duplicates:
+        deduper = None
+    elif deduper is None:
+        deduper = TransactionIDDeduper(expected_items=total_input)
+    elif not isinstance(deduper, TransactionIDDeduper):
+        raise TypeError("deduper must be a TransactionIDDeduper")
 
     for tx in transactions:
         # Check if all required fields are present and not empty
@@ -84,6 +134,11 @@ def validate_and_filter(transactions, region=None, min_amount=None, max_amount=N
             invalid_count += 1
             continue
 
+        # Replayed rows would double-count revenue, so keep only the first
+        if deduper is not None and not deduper.add(tx['TransactionID']):
+            duplicate_count += 1
+            continue
+
         valid_transactions.append(tx)
 
     # Show what regions and amounts are available
@@ -96,35 +151,14 @@ def validate_and_filter(transactions, region=None, min_amount=None, max_amount=N
     else:
         print("Transaction amount range: 0 - 0")
 
-    filtered_by_region = 0
-    filtered_by_amount = 0
-
-    filtered = valid_transactions
-
-    if region:
-        before = len(filtered)
-        filtered = [t for t in filtered if t['Region'] == region]
-        filtered_by_region = before - len(filtered)
-        print("Records after region filter:", len(filtered))
-
-    if min_amount is not None or max_amount is not None:
-        before = len(filtered)
-        temp = []
-        for t in filtered:
-            amount = t['Quantity'] * t['UnitPrice']
-            if min_amount is not None and amount < min_amount:
-                continue
-            if max_amount is not None and amount > max_amount:
-                continue
-            temp.append(t)
-
-        filtered = temp
-        filtered_by_amount = before - len(filtered)
-        print("Records after amount filter:", len(filtered))
+    filtered, filtered_by_region, filtered_by_amount = _apply_filters(
+        valid_transactions, region, min_amount, max_amount
+    )
 
     filter_summary = {
         'total_input': total_input,
         'invalid': invalid_count,
+        'duplicates': duplicate_count,
         'filtered_by_region': filtered_by_region,
         'filtered_by_amount': filtered_by_amount,
         'final_count': len(filtered)
@@ -133,6 +167,60 @@ def validate_and_filter(transactions, region=None, min_amount=None, max_amount=N
     return filtered, invalid_count, filter_summary
 
 
+def merge_shard_results(shard_results, region=None, min_amount=None, max_amount=None):
+    # Combine validate_and_filter results from shards run in parallel.
+    # shard_results is a list of (valid_transactions, filter_summary,
+    # deduper) in input order, each shard using its own TransactionIDDeduper.
+    # Shards must be run without region/amount filters; pass those here
+    # instead, so a row whose ID an earlier shard already had is counted
+    # only as a duplicate, the same as in a single run. If every shard's
+    # deduper was created with the same expected_items, covering the whole
+    # dataset, their Bloom filters are OR-ed together instead of rebuilt.
+    shard_results = list(shard_results)
+    total_ids = sum(len(deduper) for _, _, deduper in shard_results)
+    if shard_results:
+        first = shard_results[0][2]
+        merged_deduper = TransactionIDDeduper(
+            expected_items=max(total_ids, first.expected_items),
+            false_positive_rate=first.false_positive_rate
+        )
+    else:
+        merged_deduper = TransactionIDDeduper(expected_items=1)
+
+    merged_transactions = []
+    merged_summary = {
+        'total_input': 0,
+        'invalid': 0,
+        'duplicates': 0,
+        'filtered_by_region': 0,
+        'filtered_by_amount': 0,
+        'final_count': 0
+    }
+
+    for valid_transactions, filter_summary, deduper in shard_results:
+        if filter_summary['filtered_by_region'] or filter_summary['filtered_by_amount']:
+            raise ValueError("Run shards without region/amount filters and pass them to merge_shard_results")
+
+        merged_summary['total_input'] += filter_summary['total_input']
+        merged_summary['invalid'] += filter_summary['invalid']
+        merged_summary['duplicates'] += filter_summary['duplicates']
+
+        repeated = set(merged_deduper.merge(deduper))
+        kept = [t for t in valid_transactions if t['TransactionID'] not in repeated]
+        merged_summary['duplicates'] += len(repeated)
+
+        merged_transactions.extend(kept)
+
+    filtered, filtered_by_region, filtered_by_amount = _apply_filters(
+        merged_transactions, region, min_amount, max_amount
+    )
+    merged_summary['filtered_by_region'] = filtered_by_region
+    merged_summary['filtered_by_amount'] = filtered_by_amount
+    merged_summary['final_count'] = len(filtered)
+
+    return filtered, merged_summary, merged_deduper
+
+
 def calculate_total_revenue(transactions):
     total_revenue = 0.0
 
@@ -264,6 +352,206 @@ def customer_analysis(transactions):
     return result
 
 
+def _customer_partition(customer_id, num_partitions, seed):
+    # blake2b instead of hash() so partitions don't depend on PYTHONHASHSEED,
+    # and the seed really reshuffles customers when a partition is re-split
+    digest = hashlib.blake2b(f"{seed}:{customer_id}".encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big') % num_partitions
+
+
+def _open_partitions(work_dir, num_partitions):
+    paths = []
+    files = []
+    for i in range(num_partitions):
+        fd, path = tempfile.mkstemp(prefix='customers_', suffix='.part', dir=work_dir)
+        paths.append(path)
+        files.append(os.fdopen(fd, 'w', encoding='utf-8'))
+    return paths, files
+
+
+def _finish_customer_stats(customer_stats):
+    # Same post-processing as customer_analysis, plus the first-seen index
+    # so ties on total_spent keep the original (stable sort) order
+    finished = []
+    for customer_id, stats in customer_stats.items():
+        if stats['purchase_count'] > 0:
+            avg_order_value = stats['total_spent'] / stats['purchase_count']
+        else:
+            avg_order_value = 0.0
+        finished.append((
+            -stats['total_spent'],
+            stats['first_seen'],
+            customer_id,
+            {
+                'total_spent': stats['total_spent'],
+                'purchase_count': stats['purchase_count'],
+                'products_bought': sorted(list(stats['products_bought'])),
+                'avg_order_value': avg_order_value
+            }
+        ))
+    finished.sort(key=lambda x: (x[0], x[1]))
+    return finished
+
+
+def _apply_customer_record(customer_stats, record):
+    # record is either a raw row ("row") or a partial aggregate that was
+    # spilled from memory ("state"); a state always comes before the rows
+    # that follow it for the same customer, so float sums stay identical
+    kind, first_seen, customer_id = record[0], record[1], record[2]
+
+    if customer_id not in customer_stats:
+        customer_stats[customer_id] = {
+            'first_seen': first_seen,
+            'total_spent': 0.0,
+            'purchase_count': 0,
+            'products_bought': set()
+        }
+
+    stats = customer_stats[customer_id]
+    if kind == 'state':
+        stats['total_spent'] = record[3]
+        stats['purchase_count'] = record[4]
+        stats['products_bought'].update(record[5])
+    else:
+        stats['total_spent'] += record[3]
+        stats['purchase_count'] += 1
+        stats['products_bought'].add(record[4])
+
+
+def _spill_customer_stats(customer_stats, files, num_partitions, seed):
+    for customer_id, stats in customer_stats.items():
+        index = _customer_partition(customer_id, num_partitions, seed)
+        record = [
+            'state', stats['first_seen'], customer_id,
+            stats['total_spent'], stats['purchase_count'],
+            sorted(stats['products_bought'])
+        ]
+        files[index].write(json.dumps(record) + '\n')
+
+
+def _aggregate_customer_records(records, max_customers, num_partitions, work_dir, seed):
+    # Aggregate in memory until more than max_customers are held, then
+    # hash-partition everything into temp files and aggregate each one.
+    # Returns a list of sorted runs (lists or run file paths).
+    customer_stats = {}
+    paths = None
+    files = None
+
+    for record in records:
+        customer_id = record[2]
+
+        if files is not None:
+            index = _customer_partition(customer_id, num_partitions, seed)
+            files[index].write(json.dumps(record) + '\n')
+            continue
+
+        if customer_id not in customer_stats and len(customer_stats) >= max_customers:
+            paths, files = _open_partitions(work_dir, num_partitions)
+            _spill_customer_stats(customer_stats, files, num_partitions, seed)
+            customer_stats = {}
+            index = _customer_partition(customer_id, num_partitions, seed)
+            files[index].write(json.dumps(record) + '\n')
+            continue
+
+        _apply_customer_record(customer_stats, record)
+
+    if files is None:
+        return [_finish_customer_stats(customer_stats)]
+
+    for f in files:
+        f.close()
+
+    runs = []
+    for path in paths:
+        # A partition can still be too big (skewed hashing), so recurse
+        # with a different seed until every piece fits the budget
+        sub_runs = _aggregate_customer_records(
+            _read_customer_records(path), max_customers, num_partitions, work_dir, seed + 1
+        )
+        os.remove(path)
+
+        for run in sub_runs:
+            if isinstance(run, str):
+                runs.append(run)
+            elif run:
+                runs.append(_write_customer_run(run, work_dir))
+
+    return runs
+
+
+def _read_customer_records(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            yield json.loads(line)
+
+
+def _write_customer_run(run, work_dir):
+    fd, path = tempfile.mkstemp(prefix='customers_', suffix='.run', dir=work_dir)
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        for neg_total, first_seen, customer_id, stats in run:
+            f.write(json.dumps([neg_total, first_seen, customer_id, stats]) + '\n')
+    return path
+
+
+def _iter_customer_run(run):
+    if isinstance(run, str):
+        for item in _read_customer_records(run):
+            yield tuple(item)
+    else:
+        for item in run:
+            yield item
+
+
+def _merge_customer_runs(runs):
+    # k-way merge of sorted runs
+    return heapq.merge(
+        *[_iter_customer_run(run) for run in runs],
+        key=lambda x: (x[0], x[1])
+    )
+
+
+def iter_customer_analysis_external(transactions, max_customers=100000, num_partitions=16,
+                                    max_merge_runs=64, temp_dir=None):
+    # Streaming version of customer_analysis: yields (customer_id, stats)
+    # in the same order, holding at most max_customers aggregates in memory
+    # and at most max_merge_runs run files open at once
+    if max_customers < 1:
+        raise ValueError("max_customers must be at least 1")
+    if num_partitions < 2:
+        raise ValueError("num_partitions must be at least 2")
+    if max_merge_runs < 2:
+        raise ValueError("max_merge_runs must be at least 2")
+
+    def records():
+        for position, transaction in enumerate(transactions):
+            yield [
+                'row', position, transaction['CustomerID'],
+                transaction['Quantity'] * transaction['UnitPrice'],
+                transaction['ProductName']
+            ]
+
+    with tempfile.TemporaryDirectory(prefix='customer_analysis_', dir=temp_dir) as work_dir:
+        runs = _aggregate_customer_records(records(), max_customers, num_partitions, work_dir, 0)
+
+        # Merge in passes until few enough runs are left for the final merge
+        while len(runs) > max_merge_runs:
+            merged_runs = []
+            for i in range(0, len(runs), max_merge_runs):
+                group = runs[i:i + max_merge_runs]
+                if len(group) == 1:
+                    merged_runs.append(group[0])
+                    continue
+
+                merged_runs.append(_write_customer_run(_merge_customer_runs(group), work_dir))
+                for run in group:
+                    if isinstance(run, str):
+                        os.remove(run)
+            runs = merged_runs
+
+        for neg_total, first_seen, customer_id, stats in _merge_customer_runs(runs):
+            yield customer_id, stats
+
+
 def daily_sales_trend(transactions):
     daily_stats = {}
 
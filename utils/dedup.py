@@ -0,0 +1,289 @@
+import hashlib
+import math
+import random
+from array import array
+from bisect import bisect_left, bisect_right
+
+
+# Numeric IDs are packed as number * 32 + digit count, so "T018" and "T18"
+# stay different keys. 17 digits keeps the packed value inside 64 bits.
+MAX_ID_DIGITS = 17
+
+# How many new keys to buffer in a set before sorting them into a run
+BUFFER_SIZE = 65536
+
+# Elements sorted at a time when merging two runs
+MERGE_CHUNK = 65536
+
+_MASK64 = (1 << 64) - 1
+
+# Bit patterns for the blocked Bloom filter, keyed by bits per pattern
+_PATTERNS = {}
+
+
+def transaction_id_key(transaction_id):
+    # Turn "T123" into a compact int, or None if the ID isn't T + digits
+    digits = transaction_id[1:]
+    num_digits = len(digits)
+    if transaction_id[:1] == 'T' and 0 < num_digits <= MAX_ID_DIGITS and digits.isascii() and digits.isdigit():
+        return int(digits) * 32 + num_digits
+    return None
+
+
+def transaction_id_from_key(key):
+    digits = str(key >> 5)
+    return 'T' + digits.zfill(key & 31)
+
+
+def _hash_key(key):
+    # One 64-bit hash per key: two multiply/xor-shift rounds for packed
+    # ints, a single blake2b digest for anything else
+    if isinstance(key, int):
+        h = (key * 0x9E3779B97F4A7C15) & _MASK64
+        h ^= h >> 32
+        return (h * 0xC2B2AE3D27D4EB4F) & _MASK64
+    digest = hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big')
+
+
+def _bit_patterns(num_hashes):
+    # 4096 fixed 64-bit masks with num_hashes bits set each. Seeded, so
+    # every filter with the same num_hashes uses the same patterns.
+    if num_hashes not in _PATTERNS:
+        rng = random.Random(num_hashes)
+        patterns = []
+        for _ in range(4096):
+            mask = 0
+            for bit in rng.sample(range(64), num_hashes):
+                mask |= 1 << bit
+            patterns.append(mask)
+        _PATTERNS[num_hashes] = patterns
+    return _PATTERNS[num_hashes]
+
+
+def _merge_sorted_runs(a, b):
+    # Merge two sorted runs of distinct keys. Each step takes a chunk from
+    # one run plus everything in the other run up to the chunk's last key
+    # and sorts it with list.sort, so the work is done in C and the
+    # temporary list stays around MERGE_CHUNK * 2 items.
+    merged = array('Q')
+    i = j = 0
+    while i < len(a) and j < len(b):
+        i_end = min(i + MERGE_CHUNK, len(a))
+        j_end = bisect_right(b, a[i_end - 1], j)
+        if j_end - j > MERGE_CHUNK:
+            j_end = j + MERGE_CHUNK
+            i_end = bisect_right(a, b[j_end - 1], i)
+
+        piece = a[i:i_end].tolist() + b[j:j_end].tolist()
+        piece.sort()
+        merged.fromlist(piece)
+        i, j = i_end, j_end
+
+    merged.extend(a[i:])
+    merged.extend(b[j:])
+    return merged
+
+
+def _intersect_sorted_runs(a, b):
+    # Keys present in both sorted runs, found chunk by chunk the same way
+    # as _merge_sorted_runs but with a C-level set intersection
+    common = []
+    i = j = 0
+    while i < len(a) and j < len(b):
+        i_end = min(i + MERGE_CHUNK, len(a))
+        j_end = bisect_right(b, a[i_end - 1], j)
+        if j_end - j > MERGE_CHUNK:
+            j_end = j + MERGE_CHUNK
+            i_end = bisect_right(a, b[j_end - 1], i)
+
+        common.extend(set(a[i:i_end]).intersection(b[j:j_end]))
+        i, j = i_end, j_end
+
+    return common
+
+
+class BloomFilter:
+    # Blocked Bloom filter: a key's hash picks one 64-bit word and one
+    # precomputed k-bit pattern, so add/lookup is a single word test
+    # instead of k separate bit probes. Blocking costs some accuracy, so
+    # it gets ~25% more bits than a classic filter for the same rate.
+
+    def __init__(self, expected_items=1000000, false_positive_rate=0.01):
+        expected_items = max(1, expected_items)
+        self.capacity = expected_items
+        self.false_positive_rate = false_positive_rate
+        num_bits = -expected_items * math.log(false_positive_rate) / (math.log(2) ** 2)
+        self.num_hashes = min(16, max(1, round(num_bits / expected_items * math.log(2))))
+        self.num_blocks = max(1, int(num_bits * 1.25) // 64)
+        self.blocks = array('Q', bytes(8 * self.num_blocks))
+        self.patterns = _bit_patterns(self.num_hashes)
+
+    def add(self, key):
+        # Sets the key's bits and returns True if they were all set already
+        # (i.e. the key might have been added before). The int case of
+        # _hash_key is inlined here since this runs once per row.
+        if isinstance(key, int):
+            h = (key * 0x9E3779B97F4A7C15) & _MASK64
+            h = ((h ^ (h >> 32)) * 0xC2B2AE3D27D4EB4F) & _MASK64
+        else:
+            h = _hash_key(key)
+        block = (h >> 12) % self.num_blocks
+        mask = self.patterns[h & 4095]
+        word = self.blocks[block]
+        if word & mask == mask:
+            return True
+        self.blocks[block] = word | mask
+        return False
+
+    def union_update(self, other):
+        # OR another filter of the same shape into this one, done on the
+        # whole bit array at once rather than word by word
+        size = 8 * self.num_blocks
+        bits = int.from_bytes(self.blocks.tobytes(), 'little') | int.from_bytes(other.blocks.tobytes(), 'little')
+        self.blocks = array('Q', bits.to_bytes(size, 'little'))
+
+    def same_shape(self, other):
+        return self.num_blocks == other.num_blocks and self.num_hashes == other.num_hashes
+
+    def __contains__(self, key):
+        h = _hash_key(key)
+        mask = self.patterns[h & 4095]
+        return self.blocks[(h >> 12) % self.num_blocks] & mask == mask
+
+
+class TransactionIDDeduper:
+    # Bloom filter in front, exact check behind it: numeric IDs live in
+    # sorted array('Q') runs (8 bytes each), anything else in a plain set
+
+    def __init__(self, expected_items=1000000, false_positive_rate=0.01):
+        self.expected_items = expected_items
+        self.false_positive_rate = false_positive_rate
+        self.bloom = BloomFilter(expected_items, false_positive_rate)
+        self.runs = []
+        self.buffer = set()
+        self.other_ids = set()
+        self.duplicates = 0
+
+    def _contains_key(self, key):
+        if key in self.buffer:
+            return True
+        for run in self.runs:
+            i = bisect_left(run, key)
+            if i < len(run) and run[i] == key:
+                return True
+        return False
+
+    def _flush(self):
+        if not self.buffer:
+            return
+
+        run = array('Q', sorted(self.buffer))
+        self.buffer = set()
+        self._add_run(run)
+
+    def _add_run(self, run):
+        # Size-tiered compaction: merge while the newest run is at least
+        # as big as the one before it, so there are only O(log n) runs
+        while self.runs and len(self.runs[-1]) <= len(run):
+            run = _merge_sorted_runs(self.runs.pop(), run)
+        self.runs.append(run)
+
+    def _add_key(self, key):
+        if self.bloom.add(key) and self._contains_key(key):
+            return False
+
+        self.buffer.add(key)
+        if len(self.buffer) >= BUFFER_SIZE:
+            self._flush()
+        return True
+
+    def add(self, transaction_id):
+        # Returns True the first time an ID is seen, False for a repeat
+        key = transaction_id_key(transaction_id)
+
+        if key is None:
+            if transaction_id in self.other_ids:
+                self.duplicates += 1
+                return False
+            self.other_ids.add(transaction_id)
+            return True
+
+        # Same as _add_key, inlined for the per-row path
+        if self.bloom.add(key) and self._contains_key(key):
+            self.duplicates += 1
+            return False
+
+        buffer = self.buffer
+        buffer.add(key)
+        if len(buffer) >= BUFFER_SIZE:
+            self._flush()
+        return True
+
+    def __contains__(self, transaction_id):
+        key = transaction_id_key(transaction_id)
+        if key is None:
+            return transaction_id in self.other_ids
+        return key in self.bloom and self._contains_key(key)
+
+    def keys(self):
+        self._flush()
+        for run in self.runs:
+            yield from run
+
+    def __len__(self):
+        return sum(len(run) for run in self.runs) + len(self.buffer) + len(self.other_ids)
+
+    def _sorted_keys(self):
+        # All numeric keys as one sorted run
+        self._flush()
+        merged = array('Q')
+        for run in self.runs:
+            merged = _merge_sorted_runs(merged, run)
+        return merged
+
+    def merge(self, other):
+        # Fold another shard's IDs into this one. Returns the IDs the other
+        # shard kept that this one already had; the caller has to drop those
+        # rows from the other shard's output (see merge_shard_results).
+        # Sorted runs are intersected and merged in chunks, and Bloom filters
+        # of the same shape are OR-ed, so there is no Python work per key
+        # unless the filter has to be resized.
+        other_run = other._sorted_keys()
+        self._flush()
+
+        repeated_keys = []
+        for run in self.runs:
+            repeated_keys.extend(_intersect_sorted_runs(run, other_run))
+        if repeated_keys:
+            drop = set(repeated_keys)
+            other_run = array('Q', [key for key in other_run if key not in drop])
+
+        total = sum(len(run) for run in self.runs) + len(other_run)
+        if total > self.bloom.capacity:
+            # Grow to at least double so repeated merges don't rebuild each time
+            bloom = BloomFilter(max(total, 2 * self.bloom.capacity), self.false_positive_rate)
+            for run in self.runs:
+                for key in run:
+                    bloom.add(key)
+            for key in other_run:
+                bloom.add(key)
+            self.bloom = bloom
+        elif self.bloom.same_shape(other.bloom):
+            self.bloom.union_update(other.bloom)
+        else:
+            for key in other_run:
+                self.bloom.add(key)
+
+        if other_run:
+            self._add_run(other_run)
+
+        repeated = [transaction_id_from_key(key) for key in repeated_keys]
+        for transaction_id in other.other_ids:
+            if transaction_id in self.other_ids:
+                repeated.append(transaction_id)
+            else:
+                self.other_ids.add(transaction_id)
+
+        self.duplicates += other.duplicates + len(repeated)
+        return repeated
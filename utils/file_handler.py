@@ -1,3 +1,7 @@
+def missing_file_error(filename):
+    return FileNotFoundError(f"Error: File '{filename}' not found. Please check the file path.")
+
+
 def read_sales_data(filename):
     # Try different encodings because some files might have encoding issues
     encodings = ['utf-8', 'latin-1', 'cp1252']
@@ -18,7 +22,7 @@ def read_sales_data(filename):
                 return lines
 
         except FileNotFoundError:
-            raise FileNotFoundError(f"Error: File '{filename}' not found. Please check the file path.")
+            raise missing_file_error(filename)
         except UnicodeDecodeError as e:
             last_error = e
             continue
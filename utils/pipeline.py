@@ -0,0 +1,444 @@
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+import time
+from contextlib import contextmanager
+
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CACHE_DIR = os.path.join(BASE_DIR, '.cache', 'pipeline')
+
+# Default for how long a fetched product catalog is reused before asking
+# the API again (build_sales_pipeline's api_cache_seconds)
+API_CACHE_SECONDS = 3600
+
+# A cache lock older than this is assumed to be left over from a crashed run
+LOCK_STALE_SECONDS = 60
+
+
+def hash_bytes(data):
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def hash_file(path):
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class HashingWriter:
+    # File-like object for pickle.dump that hashes everything written to
+    # it and passes it on to file, if one is given
+
+    def __init__(self, file=None):
+        self.digest = hashlib.blake2b(digest_size=16)
+        self.file = file
+
+    def write(self, data):
+        self.digest.update(data)
+        if self.file is not None:
+            self.file.write(data)
+        return len(data)
+
+    def hexdigest(self):
+        return self.digest.hexdigest()
+
+
+class Stage:
+    # One step of the pipeline.
+    #   func(params, *dep_values) -> value, or func(params, started, *dep_values)
+    #       when start is set (start(params) is called early to kick off I/O)
+    #   code:    source files whose contents are part of the cache key
+    #   inputs:  params that name files to hash into the key (e.g. the sales file)
+    #   outputs: params that name files the stage writes; a cache hit also
+    #            needs them to still be on disk unchanged
+    #   max_age: seconds a cached result stays valid (None = forever)
+    #   cache_if: predicate on the value; results it rejects aren't cached
+    #   persist: False to record the stage's key but not pickle its value;
+    #            the value is recomputed whenever a later stage needs it
+
+    def __init__(self, name, func, deps=(), params=None, code=(), inputs=(), outputs=(),
+                 message=None, start=None, max_age=None, cache_if=None, persist=True):
+        self.name = name
+        self.func = func
+        self.deps = list(deps)
+        self.params = dict(params or {})
+        self.code = list(code)
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.message = message or f"Running {name}..."
+        self.start = start
+        self.max_age = max_age
+        self.cache_if = cache_if
+        self.persist = persist
+
+
+class PipelineRunner:
+    def __init__(self, stages, cache_dir=CACHE_DIR, use_cache=True):
+        self.stages = {}
+        for stage in stages:
+            for dep in stage.deps:
+                if dep not in self.stages:
+                    raise ValueError(f"Stage '{stage.name}' depends on unknown stage '{dep}'")
+            self.stages[stage.name] = stage
+
+        self.cache_dir = cache_dir
+        self.use_cache = use_cache
+        self.index_file = os.path.join(cache_dir, 'index.json')
+        self.index = self._load_index()
+
+        self.output_hashes = {}
+        self.values = {}
+        self.started = {}
+        self.executed = []
+        self._code_hashes = {}
+
+    def _load_index(self):
+        if not self.use_cache or not os.path.exists(self.index_file):
+            return {}
+        try:
+            with open(self.index_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    @contextmanager
+    def _index_lock(self):
+        # Several runs can share the cache dir, so changes to the index and
+        # the pickles it refers to happen under an exclusive lock file
+        lock_file = os.path.join(self.cache_dir, 'index.lock')
+        while True:
+            try:
+                fd = os.open(lock_file, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                break
+            except FileExistsError:
+                try:
+                    if time.time() - os.path.getmtime(lock_file) > LOCK_STALE_SECONDS:
+                        os.remove(lock_file)
+                        continue
+                except OSError:
+                    continue
+                time.sleep(0.05)
+
+        try:
+            yield
+        finally:
+            os.close(fd)
+            os.remove(lock_file)
+
+    def _save_index(self):
+        # Caller holds _index_lock
+        fd, temp_file = tempfile.mkstemp(suffix='.tmp', dir=self.cache_dir)
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(self.index, f, indent=1, sort_keys=True)
+        os.replace(temp_file, self.index_file)
+
+    def _value_file(self, output_hash):
+        return os.path.join(self.cache_dir, output_hash + '.pkl')
+
+    def _code_hash(self, path):
+        if path not in self._code_hashes:
+            self._code_hashes[path] = hash_file(os.path.join(BASE_DIR, path))
+        return self._code_hashes[path]
+
+    def set_params(self, name, **params):
+        # Changing params invalidates this stage and everything after it
+        self.stages[name].params.update(params)
+        for other in self._downstream(name):
+            self.output_hashes.pop(other, None)
+            self.values.pop(other, None)
+
+    def _downstream(self, name):
+        found = [name]
+        for stage in self.stages.values():
+            if any(dep in found for dep in stage.deps) and stage.name not in found:
+                found.append(stage.name)
+        return found
+
+    def _order(self, targets):
+        # Dependencies first; stages are declared in dependency order
+        needed = set()
+        pending = list(targets)
+        while pending:
+            name = pending.pop()
+            if name not in needed:
+                needed.add(name)
+                pending.extend(self.stages[name].deps)
+        return [name for name in self.stages if name in needed]
+
+    def _stage_key(self, stage):
+        parts = {
+            'stage': stage.name,
+            'params': stage.params,
+            'code': [self._code_hash(path) for path in stage.code],
+            'inputs': [hash_file(stage.params[param]) for param in stage.inputs],
+            'deps': [self.output_hashes[dep] for dep in stage.deps]
+        }
+        return hash_bytes(json.dumps(parts, sort_keys=True, default=str).encode('utf-8'))
+
+    def _cache_entry(self, stage, key):
+        entry = self.index.get(key)
+        if entry is None:
+            return None
+
+        if stage.max_age is not None and time.time() - entry['created'] > stage.max_age:
+            return None
+
+        if entry.get('persisted', True) and not os.path.exists(self._value_file(entry['output'])):
+            return None
+
+        for path, file_hash in entry['files'].items():
+            if not os.path.exists(path) or hash_file(path) != file_hash:
+                return None
+
+        return entry
+
+    def _check_inputs(self, names):
+        # Fail with read_sales_data's message before anything is started
+        for name in names:
+            stage = self.stages[name]
+            for param in stage.inputs:
+                if not os.path.isfile(stage.params[param]):
+                    from utils.file_handler import missing_file_error
+                    raise missing_file_error(stage.params[param])
+
+    def start_background(self, targets=None):
+        # Kick off uncached stages that have a start hook and no
+        # dependencies (e.g. the API fetch) before anything else runs
+        names = self._order(targets or list(self.stages))
+        self._check_inputs(names)
+        for name in names:
+            stage = self.stages[name]
+            if stage.start is None or stage.deps or name in self.started:
+                continue
+            if self.use_cache and self._cache_entry(stage, self._stage_key(stage)):
+                continue
+            self.started[name] = stage.start(stage.params)
+
+    def run(self, targets=None):
+        names = self._order(targets or list(self.stages))
+        self._check_inputs(names)
+        for name in names:
+            if name in self.output_hashes:
+                continue
+
+            stage = self.stages[name]
+            key = None
+            entry = None
+            if self.use_cache:
+                key = self._stage_key(stage)
+                entry = self._cache_entry(stage, key)
+
+            if entry is not None:
+                print(f"{stage.message} (cached)")
+                self.output_hashes[name] = entry['output']
+                continue
+
+            self._execute(stage, key)
+
+    def _execute(self, stage, key):
+        print(stage.message)
+        dep_values = [self.value(dep) for dep in stage.deps]
+        if stage.start is not None:
+            started = self.started.pop(stage.name, None)
+            if started is None:
+                started = stage.start(stage.params)
+            value = stage.func(stage.params, started, *dep_values)
+        else:
+            value = stage.func(stage.params, *dep_values)
+
+        self.executed.append(stage.name)
+        self._store(stage, key, value)
+
+    def _store(self, stage, key, value):
+        self.values[stage.name] = value
+
+        # Without a cache there are no keys to compute, so nothing to hash
+        if not self.use_cache:
+            self.output_hashes[stage.name] = None
+            return
+
+        # Uncached results still need a hash for the keys of later stages
+        if stage.cache_if is not None and not stage.cache_if(value):
+            writer = HashingWriter()
+            pickle.dump(value, writer, protocol=pickle.HIGHEST_PROTOCOL)
+            self.output_hashes[stage.name] = writer.hexdigest()
+            return
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        temp_file = None
+        if stage.persist:
+            # Stream the pickle to a private temp file while hashing it
+            fd, temp_file = tempfile.mkstemp(suffix='.tmp', dir=self.cache_dir)
+            with os.fdopen(fd, 'wb') as f:
+                writer = HashingWriter(f)
+                pickle.dump(value, writer, protocol=pickle.HIGHEST_PROTOCOL)
+            output_hash = writer.hexdigest()
+        else:
+            # Nothing is written; the key already covers everything the
+            # value was computed from, so it stands in for the value's hash
+            output_hash = key
+
+        self.output_hashes[stage.name] = output_hash
+        entry = {
+            'stage': stage.name,
+            'output': output_hash,
+            'persisted': stage.persist,
+            'created': time.time(),
+            'files': {stage.params[param]: hash_file(stage.params[param]) for param in stage.outputs}
+        }
+
+        # Move the pickle into place under its content hash and update the
+        # index as it is on disk now, not as this run loaded it
+        with self._index_lock():
+            if temp_file is not None:
+                value_file = self._value_file(output_hash)
+                if os.path.exists(value_file):
+                    os.remove(temp_file)
+                else:
+                    os.replace(temp_file, value_file)
+
+            self.index = self._load_index()
+            self.index[key] = entry
+            self._prune(stage.name, key)
+            self._save_index()
+
+    def _prune(self, name, key):
+        # Caller holds _index_lock. Keep only the newest entry per stage, and
+        # delete pickles nothing refers to anymore (outputs loaded in this run
+        # are kept too). Another run may lose a pickle it was about to load;
+        # value() recomputes the stage in that case.
+        for other_key in list(self.index):
+            if other_key != key and self.index[other_key]['stage'] == name:
+                del self.index[other_key]
+
+        referenced = set(entry['output'] for entry in self.index.values())
+        referenced.update(h for h in self.output_hashes.values() if h is not None)
+
+        for filename in os.listdir(self.cache_dir):
+            if filename.endswith('.pkl') and filename[:-len('.pkl')] not in referenced:
+                os.remove(os.path.join(self.cache_dir, filename))
+
+    def value(self, name):
+        # Values of cached stages are only loaded from disk when needed.
+        # Stages that aren't persisted, or whose pickle was pruned by
+        # another run, are recomputed instead.
+        if name not in self.output_hashes:
+            self.run([name])
+        if name in self.values:
+            return self.values[name]
+
+        stage = self.stages[name]
+        if stage.persist:
+            try:
+                with open(self._value_file(self.output_hashes[name]), 'rb') as f:
+                    self.values[name] = pickle.load(f)
+                return self.values[name]
+            except FileNotFoundError:
+                pass
+
+        self._execute(stage, self._stage_key(stage))
+        return self.values[name]
+
+
+# Stage functions for the sales pipeline. Each one imports what it needs
+# so a fully cached run never loads requests or the report code.
+
+def _read_stage(params):
+    from utils.file_handler import read_sales_data
+    raw_lines = read_sales_data(params['filename'])
+    print(f"Loaded {len(raw_lines)} rows")
+    return raw_lines
+
+
+def _parse_stage(params, raw_lines):
+    from utils.data_processor import parse_transactions
+    transactions = parse_transactions(raw_lines)
+    print(f"Parsed {len(transactions)} records")
+    return transactions
+
+
+def _validate_stage(params, transactions):
+    from utils.data_processor import validate_and_filter
+    valid_transactions, invalid_count, filter_summary = validate_and_filter(
+        transactions,
+        region=params['region'],
+        min_amount=params['min_amount'],
+        max_amount=params['max_amount']
+    )
+    print(f"Valid: {len(valid_transactions)}, Invalid: {invalid_count}, Duplicates: {filter_summary['duplicates']}")
+    return valid_transactions, invalid_count, filter_summary
+
+
+def _start_fetch(params):
+    from utils.api_handler import start_product_fetch
+    return start_product_fetch(params['url'])
+
+
+def _fetch_stage(params, product_fetch):
+    from utils.api_handler import wait_for_products
+    return wait_for_products(product_fetch, deadline=params['deadline'])
+
+
+def _enrich_stage(params, validated, api_products):
+    from utils.api_handler import create_product_mapping, enrich_sales_data
+    product_mapping = create_product_mapping(api_products)
+    enriched_transactions = enrich_sales_data(validated[0], product_mapping)
+    print(f"Enriched {len(enriched_transactions)} transactions")
+    return enriched_transactions
+
+
+def _save_stage(params, enriched_transactions):
+    from utils.api_handler import save_enriched_data
+    save_enriched_data(enriched_transactions, params['enriched_file'])
+
+
+def _report_stage(params, validated, enriched_transactions):
+    from utils.report_generator import generate_sales_report
+    generate_sales_report(validated[0], enriched_transactions, params['report_file'])
+
+
+def build_sales_pipeline(filename='data/sales_data.txt', region=None, min_amount=None, max_amount=None,
+                         enriched_file='data/enriched_sales_data.txt', report_file='output/sales_report.txt',
+                         api_url=None, api_deadline=15, api_cache_seconds=API_CACHE_SECONDS,
+                         cache_dir=CACHE_DIR, use_cache=True):
+    if api_url is None:
+        from utils.api_handler import PRODUCTS_URL
+        api_url = PRODUCTS_URL
+
+    # read isn't persisted since its value is just a copy of the sales file,
+    # and enrich isn't since re-joining validate with fetch is faster than
+    # unpickling the enriched rows
+    pipeline_code = 'utils/pipeline.py'
+    stages = [
+        Stage('read', _read_stage, params={'filename': filename}, inputs=['filename'],
+              code=[pipeline_code, 'utils/file_handler.py'], persist=False,
+              message="Reading sales data..."),
+        Stage('parse', _parse_stage, deps=['read'],
+              code=[pipeline_code, 'utils/data_processor.py'], message="Parsing transactions..."),
+        Stage('validate', _validate_stage, deps=['parse'],
+              params={'region': region, 'min_amount': min_amount, 'max_amount': max_amount},
+              code=[pipeline_code, 'utils/data_processor.py', 'utils/dedup.py'],
+              message="Validating transactions..."),
+        # Failed or timed-out fetches come back empty; don't cache those
+        Stage('fetch', _fetch_stage, params={'url': api_url, 'deadline': api_deadline},
+              code=[pipeline_code, 'utils/api_handler.py'], start=_start_fetch,
+              max_age=api_cache_seconds, cache_if=bool,
+              message="Fetching product data from API..."),
+        Stage('enrich', _enrich_stage, deps=['validate', 'fetch'],
+              code=[pipeline_code, 'utils/api_handler.py'], persist=False,
+              message="Enriching transactions..."),
+        Stage('save', _save_stage, deps=['enrich'], params={'enriched_file': enriched_file},
+              outputs=['enriched_file'], code=[pipeline_code, 'utils/api_handler.py'],
+              message="Saving enriched data..."),
+        Stage('report', _report_stage, deps=['validate', 'enrich'], params={'report_file': report_file},
+              outputs=['report_file'],
+              code=[pipeline_code, 'utils/report_generator.py', 'utils/data_processor.py'],
+              message="Generating report...")
+    ]
+
+    return PipelineRunner(stages, cache_dir=cache_dir, use_cache=use_cache)
@@ -1,17 +1,24 @@
 import os
 from datetime import datetime
+from itertools import islice
 from utils.data_processor import (
     calculate_total_revenue,
     region_wise_sales,
     top_selling_products,
-    customer_analysis,
+    iter_customer_analysis_external,
     daily_sales_trend,
     find_peak_sales_day,
     low_performing_products
 )
 
 
-def generate_sales_report(transactions, enriched_transactions, output_file='output/sales_report.txt'):
+# Most customers whose totals are kept in memory while ranking them; past
+# this the ranking spills to temp files. This counts customers, not bytes.
+REPORT_MAX_CUSTOMERS = 100000
+
+
+def generate_sales_report(transactions, enriched_transactions, output_file='output/sales_report.txt',
+                          max_customers=REPORT_MAX_CUSTOMERS):
     # Create output directory if needed
     directory = os.path.dirname(output_file)
     if directory and not os.path.exists(directory):
@@ -27,8 +34,11 @@ def generate_sales_report(transactions, enriched_transactions, output_file='outp
     region_sales = region_wise_sales(transactions)
     top_products = top_selling_products(transactions, n=5)
 
-    customer_stats = customer_analysis(transactions)
-    top_customers = list(customer_stats.items())[:5]
+    # Only the top 5 are needed, so stream them. This stays in memory until
+    # there are more than max_customers distinct customers, then spills.
+    customers = iter_customer_analysis_external(transactions, max_customers=max_customers)
+    top_customers = list(islice(customers, 5))
+    customers.close()
 
     daily_trend = daily_sales_trend(transactions)
     peak_day = find_peak_sales_day(transactions)